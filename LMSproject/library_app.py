@@ -1,166 +1,408 @@
+import atexit
+import csv
+import logging
 import os
+import queue
+import sys
+from functools import lru_cache
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
+import httpx
+from cachetools import TTLCache
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
 from dotenv import load_dotenv
 
-# Load Supabase credentials from .env file
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-sb: Client = create_client(url, key)
+logger = logging.getLogger(__name__)
+
+def _load_env(*names):
+    # Only parse the .env file when one of the needed variables is not already set
+    if any(name not in os.environ for name in names):
+        load_dotenv()
+
+@lru_cache(maxsize=1)
+def get_client() -> Client:
+    # One pooled keep-alive HTTP/2 client shared by every request, so CRUD calls
+    # reuse an open connection instead of paying TCP/TLS setup each time.
+    # Tests can patch get_client, or call get_client.cache_clear() after
+    # changing the credentials.
+    _load_env("SUPABASE_URL", "SUPABASE_KEY")
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        http2=True,
+        timeout=60,
+    )
+    return create_client(
+        os.environ["SUPABASE_URL"],
+        os.environ["SUPABASE_KEY"],
+        options=SyncClientOptions(httpx_client=http_client),
+    )
+
+@lru_cache(maxsize=1)
+def get_db_pool():
+    # Optional direct Postgres URL (Supavisor transaction port) for borrow/return.
+    # Transaction-mode poolers do not keep server-side prepared statements, so
+    # psycopg's are disabled; the PL/pgSQL functions still cache their own
+    # plans per server session. The pool starts with one connection and grows
+    # on demand, since it is only built on the first borrow or return.
+    _load_env("SUPABASE_DB_URL")
+    db_url = os.getenv("SUPABASE_DB_URL")
+    if not db_url:
+        return None
+    # Imported here so psycopg is only needed when the direct pool is configured
+    from psycopg_pool import ConnectionPool
+    # A short timeout so a bad URL fails a borrow or return quickly
+    return ConnectionPool(db_url, min_size=1, max_size=50, open=True, timeout=5, kwargs={"prepare_threshold": None})
+
+# The catalog changes rarely, so search results are cached for a short time
+# and every write that touches books clears the cache.
+_search_cache = TTLCache(maxsize=256, ttl=60)
+
+def invalidate_books_cache():
+    _search_cache.clear()
 
 # --- Task 1: Create (Insert) ---
 
 def register_member(name, email):
     try:
+        sb = get_client()
         data = sb.table("members").insert({"name": name, "email": email}).execute()
         return data.data
-    except Exception as e:
-        print(f"Error registering member: {e}")
+    except Exception:
+        logger.exception("Error registering member")
         return None
 
 def add_book(title, author, category, stock):
     try:
+        sb = get_client()
         data = sb.table("books").insert({"title": title, "author": author, "category": category, "stock": stock}).execute()
+        invalidate_books_cache()
         return data.data
-    except Exception as e:
-        print(f"Error adding book: {e}")
+    except Exception:
+        logger.exception("Error adding book")
+        return None
+
+# PostgREST takes a JSON array per insert, so bulk loads go out in chunks
+BULK_BATCH_SIZE = 500
+
+def _insert_in_batches(table, rows):
+    sb = get_client()
+    inserted = []
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        data = sb.table(table).insert(rows[start:start + BULK_BATCH_SIZE]).execute()
+        inserted.extend(data.data)
+    return inserted
+
+def _check_fields(row, required, optional=()):
+    missing = [field for field in required if row.get(field) in (None, "")]
+    unknown = set(row) - set(required) - set(optional)
+    if missing or unknown:
+        raise ValueError(f"invalid row {row}: missing {missing}, unknown {sorted(map(str, unknown))}")
+
+def register_members_bulk(rows):
+    try:
+        members = []
+        for row in rows:
+            _check_fields(row, ("name", "email"))
+            members.append({"name": row["name"], "email": row["email"]})
+        return _insert_in_batches("members", members)
+    except Exception:
+        logger.exception("Error registering members")
+        return None
+
+def add_books_bulk(rows):
+    try:
+        # Every row carries the same keys, as PostgREST expects for array inserts
+        books = []
+        for row in rows:
+            _check_fields(row, ("title", "author", "stock"), ("category",))
+            books.append({
+                "title": row["title"],
+                "author": row["author"],
+                "category": row.get("category") or None,
+                "stock": int(row["stock"]),
+            })
+        inserted = _insert_in_batches("books", books)
+        invalidate_books_cache()
+        return inserted
+    except Exception:
+        logger.exception("Error adding books")
+        return None
+
+_BULK_IMPORTERS = {"books": add_books_bulk, "members": register_members_bulk}
+
+def import_csv(path, kind):
+    # Stream the file in batch-sized slices instead of reading it all at once.
+    # Returns the number of rows imported, or None if the import did not finish.
+    if kind not in _BULK_IMPORTERS:
+        logger.error("Error importing CSV: unknown kind %r, expected books or members", kind)
+        return None
+    bulk_insert = _BULK_IMPORTERS[kind]
+    imported = 0
+    try:
+        # utf-8-sig also accepts the byte-order mark that spreadsheet exports add
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            while batch := list(islice(reader, BULK_BATCH_SIZE)):
+                inserted = bulk_insert(batch)
+                if inserted is None:
+                    logger.error("Import stopped after %d %s; the failing batch and the rest of the file were not imported", imported, kind)
+                    return None
+                imported += len(inserted)
+    except (OSError, UnicodeDecodeError, csv.Error):
+        logger.exception("Error importing CSV after %d %s", imported, kind)
         return None
+    return imported
 
 # --- Task 2: Read (Select) ---
 
 def list_all_books():
     try:
-        books = sb.table("books").select("*").execute()
+        sb = get_client()
+        books = sb.table("books").select(BOOK_COLUMNS).execute()
         return books.data
-    except Exception as e:
-        print(f"Error fetching books: {e}")
+    except Exception:
+        logger.exception("Error fetching books")
         return None
 
-def search_books(query, search_by):
+def iter_books(page_size=1000):
+    # Page through the catalog so rows can be shown before the whole table arrives
+    offset = 0
+    try:
+        sb = get_client()
+        while True:
+            page = sb.table("books").select(BOOK_COLUMNS).order("book_id").range(offset, offset + page_size - 1).execute()
+            if not page.data:
+                return
+            yield from page.data
+            # The server may cap rows per request (max-rows), so advance by what
+            # actually came back rather than by the requested size
+            offset += len(page.data)
+    except Exception:
+        logger.exception("Error fetching books")
+
+# Catalog reads name their columns so the generated *_lower search columns stay server-side
+BOOK_COLUMNS = "book_id, title, author, category, stock"
+
+# Searchable fields mapped to the books column each one filters on
+_SEARCH_COLS = {'title': 'title', 'author': 'author', 'category': 'category'}
+# Generated lower-case columns with B-tree indexes, used for prefix searches
+_PREFIX_COLS = {'title': 'title_lower', 'author': 'author_lower', 'category': 'category_lower'}
+
+def search_books(query, search_by, prefix=False):
+    # Matching is case-insensitive, so the normalized query is both the cache
+    # key and the pattern sent to the server
+    query = query.strip().lower()
+    # The B-tree prefix path works from one character; trigram indexes need at
+    # least 3, and shorter substring queries would scan the table
+    if not query or (not prefix and len(query) < 3):
+        return []
+    cache_key = (query, search_by, prefix)
+    if cache_key in _search_cache:
+        # A copy, so callers that modify the list cannot change later hits
+        return list(_search_cache[cache_key])
     try:
-        if search_by == 'title':
-            books = sb.table("books").select("*").ilike('title', f'%{query}%').execute()
-        elif search_by == 'author':
-            books = sb.table("books").select("*").ilike('author', f'%{query}%').execute()
-        elif search_by == 'category':
-            books = sb.table("books").select("*").ilike('category', f'%{query}%').execute()
+        sb = get_client()
+        # '%' and '_' are LIKE wildcards, so the user's text is matched literally
+        pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        if prefix:
+            col = _PREFIX_COLS[search_by]
+            books = sb.table("books").select(BOOK_COLUMNS).like(col, f'{pattern}%').execute()
+        else:
+            col = _SEARCH_COLS[search_by]
+            books = sb.table("books").select(BOOK_COLUMNS).ilike(col, f'%{pattern}%').execute()
+        _search_cache[cache_key] = tuple(books.data)
         return books.data
-    except Exception as e:
-        print(f"Error searching books: {e}")
+    except Exception:
+        logger.exception("Error searching books")
         return None
 
 def show_member_details(member_id):
     try:
+        sb = get_client()
         details = sb.table("members").select("*, borrow_records(title:books(title))").eq("member_id", member_id).execute()
         return details.data
-    except Exception as e:
-        print(f"Error fetching member details: {e}")
+    except Exception:
+        logger.exception("Error fetching member details")
         return None
 
 # --- Task 3: Update ---
 
 def update_book_stock(book_id, new_stock):
     try:
+        sb = get_client()
         data = sb.table("books").update({"stock": new_stock}).eq("book_id", book_id).execute()
+        invalidate_books_cache()
         return data.data
-    except Exception as e:
-        print(f"Error updating stock: {e}")
+    except Exception:
+        logger.exception("Error updating stock")
         return None
 
 def update_member_info(member_id, new_email=None, new_name=None):
     try:
+        sb = get_client()
         update_data = {}
-        if new_email:
-            update_data['email'] = new_email
-        if new_name:
-            update_data['name'] = new_name
+        if new_email and new_email.strip():
+            update_data['email'] = new_email.strip()
+        if new_name and new_name.strip():
+            update_data['name'] = new_name.strip()
+        # Nothing to change, so skip the request entirely
+        if not update_data:
+            return []
         data = sb.table("members").update(update_data).eq("member_id", member_id).execute()
         return data.data
-    except Exception as e:
-        print(f"Error updating member info: {e}")
+    except Exception:
+        logger.exception("Error updating member info")
         return None
 
 # --- Task 4: Delete ---
 
 def delete_member(member_id):
     try:
-        # Check for any borrowed books first
-        borrowed = sb.table("borrow_records").select("*").eq("member_id", member_id).is_("return_date", "null").execute()
-        if borrowed.data:
-            print("Cannot delete member: they have outstanding borrowed books.")
+        sb = get_client()
+        # The outstanding-books check and the delete run as one statement
+        data = sb.rpc("delete_member_safe", {"p_member_id": member_id}).execute()
+        if not data.data:
+            logger.warning("Cannot delete member: not found or they have outstanding borrowed books.")
             return None
-        
-        data = sb.table("members").delete().eq("member_id", member_id).execute()
         return data.data
-    except Exception as e:
-        print(f"Error deleting member: {e}")
+    except Exception:
+        logger.exception("Error deleting member")
         return None
 
 def delete_book(book_id):
     try:
-        # Check if the book is currently borrowed
-        borrowed = sb.table("borrow_records").select("*").eq("book_id", book_id).is_("return_date", "null").execute()
-        if borrowed.data:
-            print("Cannot delete book: it is currently borrowed.")
+        sb = get_client()
+        # The currently-borrowed check and the delete run as one statement
+        data = sb.rpc("delete_book_safe", {"p_book_id": book_id}).execute()
+        if not data.data:
+            logger.warning("Cannot delete book: not found or it is currently borrowed.")
             return None
-        
-        data = sb.table("books").delete().eq("book_id", book_id).execute()
+        invalidate_books_cache()
         return data.data
-    except Exception as e:
-        print(f"Error deleting book: {e}")
+    except Exception:
+        logger.exception("Error deleting book")
         return None
 
 # --- Task 5 & 6: Borrow/Return (Transactions via RPC) ---
 
+_TRANSACTION_SQL = {
+    "borrow_book_transaction": "SELECT borrow_book_transaction(%s, %s)",
+    "return_book_transaction": "SELECT return_book_transaction(%s, %s)",
+}
+
+def _run_transaction(name, member_id, book_id):
+    pool = get_db_pool()
+    if pool is None:
+        return get_client().rpc(name, {"p_member_id": member_id, "p_book_id": book_id}).execute().data
+    with pool.connection() as conn:
+        return conn.execute(_TRANSACTION_SQL[name], (member_id, book_id)).fetchone()[0]
+
 def borrow_book(member_id, book_id):
     try:
-        response = sb.rpc("borrow_book_transaction", {"p_member_id": member_id, "p_book_id": book_id}).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error borrowing book: {e}")
+        result = _run_transaction("borrow_book_transaction", member_id, book_id)
+        if result and result.get("status") == "success":
+            invalidate_books_cache()
+        return result
+    except Exception:
+        logger.exception("Error borrowing book")
         return None
 
 def return_book(member_id, book_id):
     try:
-        response = sb.rpc("return_book_transaction", {"p_member_id": member_id, "p_book_id": book_id}).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error returning book: {e}")
+        result = _run_transaction("return_book_transaction", member_id, book_id)
+        if result and result.get("status") == "success":
+            invalidate_books_cache()
+        return result
+    except Exception:
+        logger.exception("Error returning book")
         return None
 
 # --- Task 7: Reports (Advanced Selects) ---
 
+# Each report is still available on its own for callers that need just one,
+# like show_member_details; the CLI uses get_reports() to fetch all three.
+
 def get_top_borrowed():
     try:
-        query = sb.table("borrow_records").select("book_id", count="count()").group("book_id").order("count", desc=True).limit(5)
-        books_with_details = query.select("*, book:books(title)").execute()
-        return books_with_details.data
-    except Exception as e:
-        print(f"Error getting top borrowed books: {e}")
+        sb = get_client()
+        books = sb.rpc("top_borrowed", {"p_limit": 5}).execute()
+        return books.data
+    except Exception:
+        logger.exception("Error getting top borrowed books")
         return None
 
 def get_overdue_books():
     try:
-        # Join borrow_records with books and members to get details
-        # Check for borrow_date > 14 days ago and return_date is null
-        overdue_books = sb.table("borrow_records").select("*, member:members(name), book:books(title)").gte('borrow_date', 'now()-14d').is_('return_date', 'null').execute()
+        sb = get_client()
+        # The view joins members and books and keeps open loans older than 14 days
+        overdue_books = sb.table("overdue_records_v").select("*").execute()
         return overdue_books.data
-    except Exception as e:
-        print(f"Error getting overdue books: {e}")
+    except Exception:
+        logger.exception("Error getting overdue books")
         return None
     
 def get_borrow_count_per_member():
     try:
-        query = sb.table("borrow_records").select("member_id", count="count()").group("member_id").order("count", desc=True)
-        members_with_details = query.select("*, member:members(name)").execute()
-        return members_with_details.data
-    except Exception as e:
-        print(f"Error getting borrow count: {e}")
+        sb = get_client()
+        members = sb.rpc("borrow_count_per_member").execute()
+        return members.data
+    except Exception:
+        logger.exception("Error getting borrow count")
+        return None
+
+def get_reports():
+    # Top borrowed, overdue and per-member counts in a single round trip
+    try:
+        sb = get_client()
+        reports = sb.rpc("reports_bundle").execute()
+        return reports.data
+    except Exception:
+        logger.exception("Error generating reports")
         return None
 
 # --- Command-Line Interface ---
 
+BOOK_ROW = "Title: {}, Author: {}, Stock: {}\n"
+
+def write_rows(rows, template, *keys):
+    # Format every row up front and emit the report with a single write
+    get = itemgetter(*keys)
+    sys.stdout.write("".join([template.format(*get(row)) for row in rows]))
+
+class _OneLineFormatter(logging.Formatter):
+    # "LEVEL: message: error" on one line; full tracebacks only at DEBUG
+    def __init__(self):
+        super().__init__("%(levelname)s: %(message)s")
+
+    def format(self, record):
+        if record.exc_info and not logging.getLogger().isEnabledFor(logging.DEBUG):
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = f"{record.getMessage()}: {record.exc_info[1]}"
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+        return super().format(record)
+
+def configure_logging(level=logging.WARNING):
+    # Records are queued by the caller and written by a background listener thread.
+    # QueueHandler formats each record before queueing it, so the formatter goes there.
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(_OneLineFormatter())
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx logs every request at INFO; keep it quiet even when debugging the app
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 if __name__ == "__main__":
+    configure_logging()
     while True:
         print("\n--- Library Management System Menu ---")
         print("1. Register a new member")
@@ -175,90 +417,109 @@ if __name__ == "__main__":
         print("10. Return a book")
         print("11. Generate reports")
         print("12. Exit")
+        print("13. Import books or members from CSV")
 
         choice = input("Enter your choice: ")
 
         if choice == '1':
             name = input("Enter member name: ")
             email = input("Enter member email: ")
-            register_member(name, email)
-            print("Member registered.")
+            if register_member(name, email) is not None:
+                print("Member registered.")
 
         elif choice == '2':
             title = input("Enter book title: ")
             author = input("Enter author: ")
             category = input("Enter category: ")
             stock = int(input("Enter stock count: "))
-            add_book(title, author, category, stock)
-            print("Book added.")
+            if add_book(title, author, category, stock) is not None:
+                print("Book added.")
         
         elif choice == '3':
-            books = list_all_books()
-            for book in books:
+            for book in iter_books():
                 print(f"Title: {book['title']}, Author: {book['author']}, Stock: {book['stock']}")
 
         elif choice == '4':
             search_by = input("Search by (title/author/category): ")
             query = input("Enter your search query: ")
-            books = search_books(query, search_by)
-            for book in books:
-                print(f"Title: {book['title']}, Author: {book['author']}, Stock: {book['stock']}")
+            prefix = input("Match only at the start? (y/n): ").strip().lower() == 'y'
+            books = search_books(query, search_by, prefix)
+            if books is None:
+                print("Search failed.")
+            else:
+                write_rows(books, BOOK_ROW, 'title', 'author', 'stock')
 
         elif choice == '5':
             book_id = int(input("Enter book ID to update stock: "))
             new_stock = int(input("Enter new stock count: "))
-            update_book_stock(book_id, new_stock)
-            print("Book stock updated.")
+            if update_book_stock(book_id, new_stock) is not None:
+                print("Book stock updated.")
         
         elif choice == '6':
             member_id = int(input("Enter member ID to update: "))
             new_name = input("Enter new name (leave blank to skip): ")
             new_email = input("Enter new email (leave blank to skip): ")
-            update_member_info(member_id, new_email, new_name)
-            print("Member info updated.")
+            result = update_member_info(member_id, new_email, new_name)
+            if result == []:
+                print("Nothing to update.")
+            elif result is not None:
+                print("Member info updated.")
 
         elif choice == '7':
             member_id = int(input("Enter member ID to delete: "))
-            delete_member(member_id)
-            print("Member deleted if they had no outstanding books.")
+            if delete_member(member_id) is not None:
+                print("Member deleted.")
 
         elif choice == '8':
             book_id = int(input("Enter book ID to delete: "))
-            delete_book(book_id)
-            print("Book deleted if it is not currently borrowed.")
+            if delete_book(book_id) is not None:
+                print("Book deleted.")
 
         elif choice == '9':
             member_id = int(input("Enter member ID: "))
             book_id = int(input("Enter book ID to borrow: "))
             result = borrow_book(member_id, book_id)
-            print(result)
+            if result is not None:
+                print(result)
 
         elif choice == '10':
             member_id = int(input("Enter member ID: "))
             book_id = int(input("Enter book ID to return: "))
             result = return_book(member_id, book_id)
-            print(result)
+            if result is not None:
+                print(result)
 
         elif choice == '11':
             print("--- Generating Reports ---")
+            reports = get_reports()
+            if reports is None:
+                print("Could not generate reports.")
+                continue
+            top_books = reports['top_borrowed']
+            overdue_books = reports['overdue']
+            borrow_counts = reports['borrow_counts']
+
             print("Top 5 Most Borrowed Books:")
-            top_books = get_top_borrowed()
-            for book in top_books:
-                print(f"Title: {book['book']['title']}, Borrow Count: {book['count']}")
+            write_rows(top_books, "Title: {}, Borrow Count: {}\n", 'title', 'count')
             
             print("\nMembers with Overdue Books:")
-            overdue_books = get_overdue_books()
-            for record in overdue_books:
-                print(f"Member: {record['member']['name']}, Book: {record['book']['title']}, Borrowed On: {record['borrow_date']}")
+            write_rows(overdue_books, "Member: {}, Book: {}, Borrowed On: {}\n", 'member_name', 'book_title', 'borrow_date')
 
             print("\nTotal Books Borrowed per Member:")
-            borrow_counts = get_borrow_count_per_member()
-            for record in borrow_counts:
-                print(f"Member: {record['member']['name']}, Total Books: {record['count']}")
+            write_rows(borrow_counts, "Member: {}, Total Books: {}\n", 'name', 'count')
 
         elif choice == '12':
             print("Exiting.")
             break
 
+        elif choice == '13':
+            kind = input("Import (books/members): ").strip().lower()
+            path = input("Enter CSV file path: ")
+            imported = import_csv(path, kind)
+            if imported is None:
+                print("Import did not complete.")
+            else:
+                print(f"Imported {imported} {kind}.")
+
         else:
-            print("Invalid choice. Please enter a number from 1 to 12.")
\ No newline at end of file
+            print("Invalid choice. Please enter a number from 1 to 13.")
\ No newline at end of file